@@ -0,0 +1,139 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import scrapper
+from constants import PARSE_CHUNK_SIZE
+
+
+def collect(html: str, encoding: str = 'utf-8') -> list:
+    page = scrapper.Page(html.encode(encoding), encoding)
+    return [(field, element.text_content()) for field, element in scrapper.iter_article_elements(page)]
+
+
+class ArticleElementsCheck(unittest.TestCase):
+    def test_unclosed_paragraphs(self):
+        """
+        Checks that paragraphs without closing tags are still read one by one
+        """
+        html = '<html><body><div class="entry-content"><p>First<p>Second</div></body></html>'
+
+        self.assertEqual([('text', 'First'), ('text', 'Second')], collect(html))
+
+    def test_paragraph_outside_entry_content(self):
+        """
+        Checks that only direct paragraphs of .entry-content are taken as text
+        """
+        html = ('<html><body><div class="entry-content"><p>Text</p>'
+                '<div class="ad"><p>Advert</p></div></div>'
+                '<div class="entry-content-footer"><p>Footer</p></div></body></html>')
+
+        self.assertEqual([('text', 'Text')], collect(html))
+
+    def test_topic_inside_paragraph(self):
+        """
+        Checks that a topic link inside a paragraph is reported and keeps its text in the paragraph
+        """
+        html = ('<html><body><div class="entry-content">'
+                '<p>See <a rel="category tag" href="#">Society</a> news</p></div></body></html>')
+
+        self.assertEqual([('topics', 'Society'), ('text', 'See Society news')], collect(html))
+
+    def test_text_split_across_chunks(self):
+        """
+        Checks that non-ASCII text crossing a chunk boundary is decoded intact
+        """
+        # the prefix takes an odd number of bytes in UTF-8, so the chunk boundary splits a two-byte letter
+        prefix = '<html><body><h1>Заголовок</h1><div class="entry-content"><p>'
+        filler = 'ж' * PARSE_CHUNK_SIZE
+        html = prefix + filler + '</p></div></body></html>'
+
+        for encoding in ('utf-8', 'windows-1251'):
+            with self.subTest(encoding=encoding):
+                self.assertEqual([('title', 'Заголовок'), ('text', filler)], collect(html, encoding))
+
+    def test_article_meta_fields(self):
+        """
+        Checks that author, date and title fields are recognized
+        """
+        html = ('<html><body><h1>Title</h1><ul><li class="autor"><a href="#">Name</a></li></ul>'
+                '<time class="entry-date published" datetime="2021-03-01T10:00:00+10:00">x</time>'
+                '</body></html>')
+
+        self.assertEqual([('title', 'Title'), ('author', 'Name'), ('date', 'x')], collect(html))
+
+
+class PageEncodingCheck(unittest.TestCase):
+    def test_meta_charset_is_left_to_lxml(self):
+        """
+        Checks that a page declaring its charset in <meta> is decoded by that declaration
+        """
+        content = '<html><head><meta charset="windows-1251"></head><body><h1>Заголовок</h1></body></html>'
+        content = content.encode('windows-1251')
+        response = mock.Mock(charset=None)
+
+        encoding = scrapper._page_encoding(response, content)
+
+        self.assertIsNone(encoding)
+        response.get_encoding.assert_not_called()
+        page = scrapper.Page(content, encoding)
+        self.assertEqual([('title', 'Заголовок')],
+                         [(field, element.text_content()) for field, element in scrapper.iter_article_elements(page)])
+
+    def test_undeclared_charset_is_detected(self):
+        """
+        Checks that detection runs only for pages declaring no charset at all
+        """
+        response = mock.Mock(charset=None, get_encoding=mock.Mock(return_value='windows-1251'))
+
+        self.assertEqual('utf-8', scrapper._page_encoding(response, '<h1>Заголовок</h1>'.encode()))
+        self.assertEqual('windows-1251', scrapper._page_encoding(response, '<h1>Заголовок</h1>'.encode('cp1251')))
+        self.assertEqual('koi8-r', scrapper._page_encoding(mock.Mock(charset='koi8-r'), b'<h1></h1>'))
+
+
+class ArticleParserMissingFieldsCheck(unittest.IsolatedAsyncioTestCase):
+    async def test_article_without_date_is_not_saved(self):
+        """
+        Checks that an article missing a required field is neither returned nor marked as processed
+        """
+        html = ('<html><body><h1>Title</h1><ul><li class="autor">Name</li></ul>'
+                '<div class="entry-content"><p>Text</p></div></body></html>')
+        page = scrapper.Page(html.encode(), 'utf-8')
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(scrapper, 'PARSER_STATE', os.path.join(tmp_dir, 'parser_state.jsonl')), \
+                mock.patch.object(scrapper.ArticleParser, '_processed', None), \
+                mock.patch.object(scrapper, 'fetch_page', mock.AsyncMock(return_value=page)):
+            parser = scrapper.ArticleParser(full_url='http://www.gazetaeao.ru/news/', article_id=1)
+
+            self.assertIsNone(await parser.parse(session=mock.Mock()))
+            self.assertFalse(parser.processed)
+            self.assertFalse(os.path.exists(scrapper.PARSER_STATE))
+
+    async def test_article_without_author_takes_next_id(self):
+        """
+        Checks that an article without an author is saved as NOT FOUND under the id
+        following the already processed articles
+        """
+        html = ('<html><body><h1>Title</h1>'
+                '<time class="entry-date published" datetime="2021-03-01T10:00:00+10:00">x</time>'
+                '<div class="entry-content"><p>Text</p></div></body></html>')
+        page = scrapper.Page(html.encode(), 'utf-8')
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(scrapper, 'PARSER_STATE', os.path.join(tmp_dir, 'parser_state.jsonl')), \
+                mock.patch.object(scrapper.ArticleParser, '_processed', {'http://a/', 'http://b/'}), \
+                mock.patch.object(scrapper.Article, 'save_raw') as save_raw, \
+                mock.patch.object(scrapper, 'fetch_page', mock.AsyncMock(return_value=page)):
+            parser = scrapper.ArticleParser(full_url='http://www.gazetaeao.ru/news/')
+            article = await parser.parse(session=mock.Mock())
+
+            self.assertEqual('NOT FOUND', article.author)
+            self.assertEqual(3, article.article_id)
+            save_raw.assert_called_once()
+            self.assertTrue(parser.processed)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lxml import html as lxml_html
+
+import scrapper
+
+SEED_HTML = """
+<html><body>
+    <div class="col-md-9">
+        <div class="col-md-6"><h2><a href="http://www.gazetaeao.ru/first-news/">1</a></h2></div>
+        <div class="col-md-6"><h2><a href="http://www.gazetaeao.ru/second-news/">2</a></h2></div>
+    </div>
+</body></html>
+"""
+
+SEED_PAGE = scrapper.Page(SEED_HTML.encode(), 'utf-8')
+
+
+class CrawlerFindArticlesCheck(unittest.IsolatedAsyncioTestCase):
+    async def test_fetched_page_is_processed(self):
+        """
+        Checks that the fetched seed page itself, not the result of comparing it with None,
+        reaches _process_seed
+        """
+        crawler = scrapper.Crawler(seed_urls=['http://www.gazetaeao.ru/page/1/'],
+                                   max_articles=2,
+                                   max_articles_per_seed=2)
+
+        with mock.patch.object(scrapper, 'fetch_page', mock.AsyncMock(return_value=SEED_PAGE)), \
+                mock.patch.object(crawler, '_process_seed', wraps=crawler._process_seed) as process_seed:
+            await crawler.find_articles(session=mock.Mock())
+
+        error_message = """Checking that seed pages are passed to _process_seed as parsed HTML.
+                                If fails - check how the result of fetch_page is assigned"""
+        process_seed.assert_called_once()
+        self.assertIsInstance(process_seed.call_args.args[0], lxml_html.HtmlElement, msg=error_message)
+        self.assertEqual(['http://www.gazetaeao.ru/first-news/', 'http://www.gazetaeao.ru/second-news/'],
+                         list(crawler.urls))
+
+
+class CrawlerNextPageCheck(unittest.TestCase):
+    def test_nested_pagination_markup(self):
+        """
+        Checks that the current page marker and the next page link are found at any depth of their items
+        """
+        tree = lxml_html.fromstring('<html><body><ul class="pagination">'
+                                    '<li><a><span class="current">2</span></a></li>'
+                                    '<li><div><a href="http://www.gazetaeao.ru/page/3/">3</a></div></li>'
+                                    '</ul></body></html>')
+        crawler = scrapper.CrawlerRecursive(seed_urls=['http://www.gazetaeao.ru/page/2/'],
+                                            max_articles=2,
+                                            max_articles_per_seed=2)
+
+        self.assertEqual('http://www.gazetaeao.ru/page/3/', crawler.get_search_urls(tree))
+
+
+class CrawlerResumeCheck(unittest.IsolatedAsyncioTestCase):
+    async def test_resumed_seed_keeps_its_budget(self):
+        """
+        Checks that links taken from the last seed before a restart count against its per-seed limit
+        """
+        seeds = ['http://www.gazetaeao.ru/page/{}/'.format(n) for n in (1, 2, 3)]
+        state = [(seeds[1], ['a-news/', 'b-news/', 'c-news/']),
+                 (seeds[2], ['d-news/', 'e-news/', 'f-news/']),
+                 (seeds[2], ['g-news/', 'h-news/'])]
+        last_page = ''.join('<div class="col-md-6"><h2><a href="{}-news/">x</a></h2></div>'.format(name)
+                            for name in 'ghijk')
+        last_page = scrapper.Page('<html><body><div class="col-md-9">{}</div></body></html>'.format(last_page).encode(),
+                                  'utf-8')
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.object(scrapper, 'CRAWLER_STATE', os.path.join(tmp_dir, 'crawler_state.jsonl')), \
+                mock.patch.object(scrapper, 'fetch_page', mock.AsyncMock(return_value=last_page)):
+            with open(scrapper.CRAWLER_STATE, 'wb') as file:
+                file.writelines(scrapper.orjson.dumps({'seed': seed, 'urls': urls}) + b'\n' for seed, urls in state)
+
+            crawler = scrapper.CrawlerRecursive(seed_urls=seeds[:1], max_articles=20, max_articles_per_seed=3)
+            await crawler.find_articles(session=mock.Mock())
+
+        self.assertEqual(['g-news/', 'h-news/', 'i-news/'], list(crawler.urls)[-3:])
+        self.assertEqual(9, len(crawler.urls))
+
+
+if __name__ == "__main__":
+    unittest.main()
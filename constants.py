@@ -6,8 +6,8 @@ import os
 
 PROJECT_ROOT = os.path.dirname(os.path.realpath(__file__))
 ASSETS_PATH = os.path.join(PROJECT_ROOT, 'tmp', 'articles')
-CRAWLER_STATE = os.path.join(PROJECT_ROOT, 'tmp', 'crawler.state')
-PARSER_STATE = os.path.join(PROJECT_ROOT, 'tmp', 'parser.state')
+CRAWLER_STATE = os.path.join(PROJECT_ROOT, 'tmp', 'crawler_state.jsonl')
+PARSER_STATE = os.path.join(PROJECT_ROOT, 'tmp', 'parser_state.jsonl')
 
 CRAWLER_CONFIG_PATH = os.path.join(PROJECT_ROOT, 'crawler_config.json')
 
@@ -16,3 +16,15 @@ HEADERS = {'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/
            'referer': 'http://www.gazetaeao.ru/'}
 
 COOKIES = {'beget': 'begetok'}
+
+MAX_CONNECTIONS = 32
+MAX_CONCURRENT_REQUESTS = 8
+REQUEST_TIMEOUT = 10
+REQUESTS_PER_SECOND = 4
+
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.5
+MAX_RETRY_AFTER = 30
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+PARSE_CHUNK_SIZE = 16 * 1024
@@ -1,31 +1,52 @@
 """
 Crawler implementation
 """
-import json
+import asyncio
 import logging.config
 import os
-import pickle
 import random
 import re
 import shutil
-import time
 from collections import namedtuple
 from datetime import datetime
-from json.decoder import JSONDecodeError
+from itertools import islice
 from pathlib import Path
-from typing import Any, Dict, List, Set, Tuple
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
-import requests
-from bs4 import BeautifulSoup
-from requests import RequestException
+import aiohttp
+import orjson
+from cssselect import HTMLTranslator
+from lxml import etree
+from lxml import html as lxml_html
+from lxml.etree import XPath
 
 from article import Article
-from constants import (ASSETS_PATH, COOKIES, CRAWLER_CONFIG_PATH,
-                       CRAWLER_STATE, HEADERS, PARSER_STATE)
+from constants import (ASSETS_PATH, BACKOFF_FACTOR, COOKIES,
+                       CRAWLER_CONFIG_PATH, CRAWLER_STATE, HEADERS,
+                       MAX_CONCURRENT_REQUESTS, MAX_CONNECTIONS, MAX_RETRIES,
+                       MAX_RETRY_AFTER, PARSE_CHUNK_SIZE, PARSER_STATE, REQUEST_TIMEOUT,
+                       REQUESTS_PER_SECOND, RETRY_STATUSES)
 
 logging.config.fileConfig(fname="crawler_logging.ini", disable_existing_loggers=False)
 log = logging.getLogger(__name__)
 
+_URL_RE = re.compile(r"^(https?://)?[0-9a-z]+\.[-_0-9a-z]+\.[0-9a-z/]+", re.I)
+_ARTICLE_URL_RE = re.compile(r"[a-z-]+/$")
+_META_CHARSET_RE = re.compile(rb"<meta[^>]+charset", re.I)
+
+_CSS = HTMLTranslator()
+
+_XP_NEWS = XPath(
+    _CSS.css_to_xpath("div.col-md-9 div.col-md-6 h2 a") + "/@href",
+    smart_strings=False,
+)
+_XP_NEXT_PAGE = XPath(
+    _CSS.css_to_xpath("ul.pagination li")
+    + "[.//" + _CSS.css_to_xpath("span.current", prefix="") + "]"
+    + "/following-sibling::li[1]//a/@href",
+    smart_strings=False,
+)
+
 
 class IncorrectURLError(Exception):
     """
@@ -51,6 +72,16 @@ class UnknownConfigError(Exception):
     """
 
 
+class Page(NamedTuple):
+    """
+    Raw page body along with the charset to decode it with. None leaves it
+    to the <meta> declaration of the page itself
+    """
+
+    content: bytes
+    encoding: Optional[str]
+
+
 class Crawler:
     """
     Crawler implementation
@@ -59,31 +90,39 @@ class Crawler:
     seed_urls: List[str]
     max_articles: int
     max_articles_per_seed: int
-    urls: Set[str]
+    urls: Dict[str, None]
 
     def __init__(self, seed_urls: list, max_articles: int, max_articles_per_seed: int):
         self.seed_urls = seed_urls
         self.max_articles = max_articles
         self.max_articles_per_seed = max_articles_per_seed
-        self.urls = set()
+        self.urls = {}
+        self._seen_seeds: Set[str] = set()
 
-    def find_articles(self):
+    async def find_articles(self, session: aiohttp.ClientSession):
         """
         Finds articles
         """
-        for url in self.get_search_urls():
+        seeds = [
+            url
+            for url in dict.fromkeys(self.get_search_urls())
+            if url not in self._seen_seeds
+        ]
+        self._seen_seeds.update(seeds)
+
+        pages = await asyncio.gather(*(fetch_page(session, url) for url in seeds))
 
-            if page := fetch_page(url) is None:
+        for url, page in zip(seeds, pages):
+
+            if page is None:
                 continue
 
-            links = self._process_seed(page)
-            self.urls.update(links)
+            links = self._process_seed(parse_page(page))
+            self.urls.update(dict.fromkeys(links))
 
             log.info("Seed page '%s' is processed.", url)
 
-            time.sleep(random.uniform(1, 3))
-
-            if len(self.urls) == self.max_articles:
+            if len(self.urls) >= self.max_articles:
                 return
 
     def get_search_urls(self) -> List[str]:
@@ -93,26 +132,25 @@ class Crawler:
         return self.seed_urls
 
     @staticmethod
-    def _extract_url(article_bs: BeautifulSoup) -> List[str]:
+    def _extract_url(tree: lxml_html.HtmlElement) -> List[str]:
         """
         Extracts news urls from the seed page
         """
-        news = article_bs.select("div.col-md-9 div.col-md-6 h2 a")
-        links = [article.attrs["href"] for article in news]
-
-        return links
+        return _XP_NEWS(tree)
 
-    def _process_seed(self, page: str):
+    def _process_seed(self, tree: lxml_html.HtmlElement, taken: int = 0) -> List[str]:
         """
-        Extracts specified number of links from the seed page, filters and returns them
+        Extracts specified number of new links from the seed page, filters and returns them.
+        `taken` links of this seed were already collected before
         """
-        soup = BeautifulSoup(page, "lxml")
-
-        seed_articles = self._extract_url(soup)[: self.max_articles_per_seed]
-        rus_links = [x for x in seed_articles if re.search(r"[a-z-]+/$", x)]
-        links = rus_links[: self.max_articles - len(self.urls)]
+        limit = min(self.max_articles_per_seed - taken, self.max_articles - len(self.urls))
+        links = (
+            x
+            for x in dict.fromkeys(self._extract_url(tree))
+            if x not in self.urls and _ARTICLE_URL_RE.search(x)
+        )
 
-        return links
+        return list(islice(links, max(limit, 0)))
 
 
 class CrawlerRecursive(Crawler):
@@ -120,50 +158,75 @@ class CrawlerRecursive(Crawler):
     Recursive Crawler
     """
 
-    def find_articles(self):
+    async def find_articles(self, session: aiohttp.ClientSession):
         """
         Finds articles
         """
-        self._load_state()
+        taken = self._load_state()
 
-        seed, self.seed_urls[0] = self.get_search_urls()
-        page = fetch_page(seed)
-        links = self._process_seed(page)
-        self.urls.update(links)
+        while len(self.urls) < self.max_articles:
+            seed = self.seed_urls[0]
 
-        if len(self.urls) == self.max_articles:
-            return None
+            if seed in self._seen_seeds:
+                log.warning("Seed page '%s' was already visited.", seed)
+                break
 
-        self._save_state()
+            self._seen_seeds.add(seed)
+
+            if (page := await fetch_page(session, seed)) is None:
+                break
+
+            tree = parse_page(page)
+            links = self._process_seed(tree, taken.get(seed, 0))
+            self.urls.update(dict.fromkeys(links))
+
+            next_seed = self.get_search_urls(tree)
+            del page, tree
 
-        log.info("Seed page '%s' is processed.", seed)
+            if next_seed is not None:
+                self.seed_urls[0] = next_seed
 
-        time.sleep(random.uniform(1, 3))
+            self._save_state(links)
 
-        return self.find_articles()
+            log.info("Seed page '%s' is processed.", seed)
 
-    def get_search_urls(self) -> Tuple[str, str]:
+            if next_seed is None:
+                log.info("Seed page '%s' is the last one.", seed)
+                break
+
+    def get_search_urls(  # pylint: disable=arguments-differ
+        self, tree: lxml_html.HtmlElement
+    ) -> Optional[str]:
         """
-        Gets current and next seed pages
+        Gets next seed page from the already parsed current one
         """
-        seed = self.seed_urls[0]
-        page = fetch_page(seed)
+        next_pages = _XP_NEXT_PAGE(tree)
 
-        soup = BeautifulSoup(page, "lxml")
-        next_page = soup.select_one("ul.pagination li:has(span.current) + li a")
+        return next_pages[0] if next_pages else None
 
-        return seed, next_page["href"]
+    def _save_state(self, links: List[str]) -> None:
+        with open(CRAWLER_STATE, "ab") as file:
+            file.write(orjson.dumps({"seed": self.seed_urls[0], "urls": links}) + b"\n")
 
-    def _save_state(self) -> None:
-        with open(CRAWLER_STATE, "wb") as file:
-            pickle.dump({"urls": self.urls, "seed": self.seed_urls}, file)
+    def _load_state(self) -> Dict[str, int]:
+        """
+        Restores the seed to continue from and the collected links. Returns how many
+        links were already taken from each seed page
+        """
+        taken: Dict[str, int] = {}
 
-    def _load_state(self) -> None:
         if os.path.exists(CRAWLER_STATE):
             with open(CRAWLER_STATE, "rb") as file:
-                status: Dict[str, Any] = pickle.load(file)
+                for line in file:
+                    status: Dict[str, Any] = orjson.loads(line)
+                    # links of a record come from the seed stored by the record before it
+                    seed = self.seed_urls[0]
+                    taken[seed] = taken.get(seed, 0) + len(status["urls"])
+
+                    self.seed_urls[0] = status["seed"]
+                    self.urls.update(dict.fromkeys(status["urls"]))
 
-            self.seed_urls, self.urls = status["seed"], status["urls"]
+        return taken
 
 
 class ArticleParser:
@@ -171,14 +234,16 @@ class ArticleParser:
     ArticleParser implementation
     """
 
-    article: Article
+    article: Optional[Article]
     full_url: str
-    article_id: int
+    article_id: Optional[int]
+
+    _processed: Optional[Set[str]] = None
 
-    def __init__(self, full_url: str, article_id: int):
+    def __init__(self, full_url: str, article_id: Optional[int] = None):
         self.full_url = full_url
         self.article_id = article_id
-        self.article = Article(full_url, article_id)
+        self.article = None
 
     @staticmethod
     def unify_date_format(date_str: str) -> datetime:
@@ -191,72 +256,262 @@ class ArticleParser:
     def processed(self) -> bool:
         return self.full_url in self._load_state()
 
-    def parse(self):
+    async def parse(self, session: aiohttp.ClientSession):
         """
-        Parses each article
+        Parses the article and saves it unless it was processed before
         """
-        page = fetch_page(self.full_url)
-        soup = BeautifulSoup(page, features="lxml")
+        if self.processed:
+            return None
+
+        page = await fetch_page(session, self.full_url)
+
+        if page is None:
+            return None
+
+        self.article = Article(self.full_url, self.article_id)
+        paragraphs: List[str] = []
+
+        for field, element in iter_article_elements(page):
+            if field == "text":
+                paragraphs.append(element.text_content())
+            else:
+                self._fill_article_with_meta_information(field, element)
+
+        self._fill_article_with_text(paragraphs)
 
-        self._fill_article_with_text(soup)
-        self._fill_article_with_meta_information(soup)
+        if not self.article.author:
+            self.article.author = "NOT FOUND"
 
+        missing = [
+            field
+            for field, value in (("title", self.article.title), ("date", self.article.date))
+            if not value
+        ]
+
+        if missing:
+            log.error(
+                "Article '%s' has no %s, skipping it.", self.full_url, ", ".join(missing)
+            )
+            return None
+
+        # ids are handed out only to saved articles, so they stay 1..N without gaps
+        if self.article_id is None:
+            self.article_id = len(self._load_state()) + 1
+
+        self.article.article_id = self.article_id
+        self.article.save_raw()
         self._save_state()
 
         log.info("Article #%s '%s' is processed.", self.article_id, self.full_url)
 
         return self.article
 
-    def _fill_article_with_text(self, article_soup: BeautifulSoup) -> None:
-        self.article.text = article_soup.select_one("div.entry-content").get_text()
+    def _fill_article_with_text(self, paragraphs: List[str]) -> None:
+        self.article.text = "\n".join(paragraphs)
 
-    def _fill_article_with_meta_information(self, article_soup: BeautifulSoup) -> None:
-        self.article.title = article_soup.select_one("h1").text
-        self.article.author = article_soup.select_one("li.autor").text
+    def _fill_article_with_meta_information(
+        self, field: str, element: lxml_html.HtmlElement
+    ) -> None:
+        if field == "title" and not self.article.title:
+            self.article.title = element.text_content()
 
-        date: str = article_soup.select_one("time.entry-date").attrs["datetime"]
-        self.article.date = self.unify_date_format(date)
+        elif field == "author" and not self.article.author:
+            self.article.author = element.text_content()
 
-        self.article.topics = [
-            tag.text for tag in article_soup.select('a[rel^="category"]')
-        ]
+        elif field == "date" and self.article.date is None:
+            self.article.date = self.unify_date_format(element.get("datetime"))
 
-    def _save_state(self):
-        if not os.path.exists(PARSER_STATE):
-            with open(PARSER_STATE, "wb") as file:
-                initial_state = {"processed": set()}
-                pickle.dump(initial_state, file)
+        elif field == "topics":
+            self.article.topics.append(element.text_content())
 
-        with open(PARSER_STATE, "rb") as file:
-            state = pickle.load(file)
-            state["processed"].add(self.article.url)
+    def _save_state(self) -> None:
+        self._load_state().add(self.full_url)
 
-        with open(PARSER_STATE, "wb") as file:
-            pickle.dump(state, file)
+        with open(PARSER_STATE, "ab") as file:
+            file.write(orjson.dumps({"url": self.full_url}) + b"\n")
+
+    @classmethod
+    def _load_state(cls) -> Set[str]:
+        """
+        Reads processed urls from disk once and keeps them in memory afterwards
+        """
+        if cls._processed is not None:
+            return cls._processed
+
+        processed: Set[str] = set()
 
-    @staticmethod
-    def _load_state():
         if os.path.exists(PARSER_STATE):
             with open(PARSER_STATE, "rb") as file:
-                state: Dict[str, list] = pickle.load(file)
-            return state["processed"]
-        return set()
+                processed = {orjson.loads(line)["url"] for line in file}
+
+        cls._processed = processed
+        return processed
+
+
+class RateLimiter:
+    """
+    Spaces requests out so that on average no more than `rate` of them
+    start per second, no matter how many coroutines are waiting
+    """
+
+    def __init__(self, rate: float):
+        self._interval = 1 / rate
+        self._next_slot = 0.0
+
+    async def wait(self) -> None:
+        """
+        Waits for the next free slot
+        """
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self._interval * random.uniform(0.5, 1.5)
+
+        await asyncio.sleep(slot - now)
+
+
+RATE_LIMITER = RateLimiter(REQUESTS_PER_SECOND)
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Creates a keep-alive session with a bounded connection pool. Timeouts
+    cover only connecting and reading, not waiting for a free connection
+    in the pool
+    """
+    connector = aiohttp.TCPConnector(
+        limit=MAX_CONNECTIONS, limit_per_host=MAX_CONCURRENT_REQUESTS
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=None, sock_connect=REQUEST_TIMEOUT, sock_read=REQUEST_TIMEOUT
+    )
+    return aiohttp.ClientSession(
+        connector=connector, headers=HEADERS, cookies=COOKIES, timeout=timeout
+    )
 
 
-def fetch_page(url: str):
+async def fetch_page(session: aiohttp.ClientSession, url: str) -> Optional[Page]:
     """
-    Fetches the seed page and returns its content
+    Fetches the page and returns its undecoded content, retrying transient
+    failures with exponential backoff
     """
+    for attempt in range(MAX_RETRIES):
+        delay = BACKOFF_FACTOR * 2 ** attempt
+        await RATE_LIMITER.wait()
+
+        try:
+            async with session.get(url) as response:
+                if response.status not in RETRY_STATUSES:
+                    response.raise_for_status()
+                    content = await response.read()
+                    return Page(content, _page_encoding(response, content))
+
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = min(int(retry_after), MAX_RETRY_AFTER)
+
+                log.warning(
+                    "Got status %s while getting '%s' (attempt %s of %s).",
+                    response.status, url, attempt + 1, MAX_RETRIES,
+                )
+
+        except aiohttp.ClientResponseError as exc:
+            log.error("Got status %s while getting '%s'.", exc.status, url)
+            return None
+
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            log.warning(
+                "%s was encountered while getting '%s' (attempt %s of %s).",
+                exc.__class__.__name__, url, attempt + 1, MAX_RETRIES,
+            )
+
+        if attempt < MAX_RETRIES - 1:
+            await asyncio.sleep(delay)
+
+    log.error("Could not get '%s'.", url)
+    return None
+
+
+def _page_encoding(response: aiohttp.ClientResponse, content: bytes) -> Optional[str]:
+    """
+    Returns the server charset if there is one. Pages declaring their charset
+    in <meta> are left to libxml2, and only pages declaring nothing at all
+    fall back to detection
+    """
+    # 1024 bytes is the window browsers prescan for a <meta> charset
+    if response.charset or _META_CHARSET_RE.search(content, 0, 1024):
+        return response.charset
+
     try:
-        response = requests.get(url, headers=HEADERS, cookies=COOKIES)
-        response.raise_for_status()
-        return response.text
+        content.decode("utf-8")
+    except UnicodeDecodeError:
+        return response.get_encoding()
 
-    except (RequestException, ConnectionError) as exc:
-        log.exception(
-            "%s was encountered while getting seed_urls", exc.__class__.__name__
-        )
-        return None
+    return "utf-8"
+
+
+def _article_field(element: lxml_html.HtmlElement) -> Optional[str]:
+    """
+    Tells which article field the element holds, if any
+    """
+    tag, classes = element.tag, element.get("class", "").split()
+
+    if tag == "h1":
+        return "title"
+    if tag == "li" and "autor" in classes:
+        return "author"
+    if tag == "time" and "entry-date" in classes:
+        return "date"
+    if tag == "a" and element.get("rel", "").startswith("category"):
+        return "topics"
+    if tag == "p" and "entry-content" in element.getparent().get("class", "").split():
+        return "text"
+    return None
+
+
+def parse_page(page: Page) -> lxml_html.HtmlElement:
+    """
+    Builds the tree straight from the page bytes
+    """
+    parser = lxml_html.HTMLParser(encoding=page.encoding)
+    return lxml_html.fromstring(page.content, parser=parser)
+
+
+def iter_article_elements(page: Page) -> Iterator[Tuple[str, lxml_html.HtmlElement]]:
+    """
+    Streams article elements from the page along with the field they hold.
+    Processed subtrees are dropped right away, so the whole document is never
+    kept in memory as a tree
+    """
+    parser = etree.HTMLPullParser(events=("start", "end"), encoding=page.encoding)
+    parser.set_element_class_lookup(lxml_html.HtmlElementClassLookup())
+    open_fields = 0
+
+    def read_events() -> Iterator[Tuple[str, lxml_html.HtmlElement]]:
+        nonlocal open_fields
+
+        for event, element in parser.read_events():
+            field = _article_field(element)
+
+            if event == "start":
+                open_fields += field is not None
+                continue
+
+            if field is not None:
+                open_fields -= 1
+                yield field, element
+
+            if not open_fields and (parent := element.getparent()) is not None:
+                element.clear()
+                del parent[: parent.index(element)]
+
+    content = page.content
+
+    for start in range(0, len(content), PARSE_CHUNK_SIZE):
+        parser.feed(content[start : start + PARSE_CHUNK_SIZE])
+        yield from read_events()
+
+    parser.close()
+    yield from read_events()
 
 
 def prepare_environment(base_path: str) -> None:
@@ -274,14 +529,16 @@ def validate_config(crawler_path: str) -> Tuple[List[str], int, int]:
     Check = namedtuple("Check", ["status", "error"])
 
     try:
-        with open(crawler_path) as file:
-            config: dict = json.load(file)
+        with open(crawler_path, "rb") as file:
+            config: dict = orjson.loads(file.read())
 
+        base_urls = config["base_urls"]
         total_num = config["total_articles_to_find_and_parse"]
-        url_check = re.compile(r"^(https?://)?[0-9a-z]+\.[-_0-9a-z]+\.[0-9a-z/]+", re.I)
 
         is_correct_total_num = isinstance(total_num, int)
-        is_correct_url = all(url_check.match(str(x)) for x in config["base_urls"])
+        is_correct_url = isinstance(base_urls, list) and all(
+            isinstance(x, str) and _URL_RE.match(x) for x in base_urls
+        )
         is_num_not_oor = is_correct_total_num and 0 < total_num <= 100000
 
         checks = (
@@ -295,12 +552,12 @@ def validate_config(crawler_path: str) -> Tuple[List[str], int, int]:
                 raise check.error("Could not check config.")
 
         return (
-            config["base_urls"],
-            config["total_articles_to_find_and_parse"],
+            base_urls,
+            total_num,
             config["max_number_articles_to_get_from_one_seed"],
         )
 
-    except (JSONDecodeError, KeyError) as exc:
+    except (orjson.JSONDecodeError, KeyError) as exc:
         log.exception(
             "%s was encountered while validating crawler config.",
             exc.__class__.__name__,
@@ -308,7 +565,14 @@ def validate_config(crawler_path: str) -> Tuple[List[str], int, int]:
         raise UnknownConfigError from exc
 
 
-def main():
+async def parse_article(session: aiohttp.ClientSession, full_url: str) -> None:
+    """
+    Parses a single article and saves it unless it was processed before
+    """
+    await ArticleParser(full_url=full_url).parse(session)
+
+
+async def main():
     urls, max_num_articles, max_per_seed = validate_config(CRAWLER_CONFIG_PATH)
     crawler = CrawlerRecursive(
         seed_urls=urls,
@@ -319,21 +583,20 @@ def main():
     if not os.path.exists(ASSETS_PATH):
         prepare_environment(ASSETS_PATH)
 
-    crawler.find_articles()
+    async with create_session() as session:
+        await crawler.find_articles(session)
 
-    for idx, article_url in enumerate(sorted(crawler.urls), 1):
-        parser = ArticleParser(full_url=article_url, article_id=idx)
-
-        if parser.processed:
-            continue
-
-        article = parser.parse()
-        article.save_raw()
+        results = await asyncio.gather(
+            *(parse_article(session, article_url) for article_url in crawler.urls),
+            return_exceptions=True,
+        )
 
-        time.sleep(random.uniform(2, 4))
+    for article_url, result in zip(crawler.urls, results):
+        if isinstance(result, Exception):
+            log.error("Could not parse '%s'.", article_url, exc_info=result)
 
     log.info("Total: %s articles.", len(crawler.urls))
 
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())